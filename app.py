@@ -1,12 +1,26 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
-import base64
+import io
+import hashlib
 import re
-import pandas as pd
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import os
 
+try:
+    import orjson
+except ImportError:  # optional speedup; the stdlib parser is used without it
+    orjson = None
+
 # Page configuration
 st.set_page_config(
     page_title="Vectara Financial Analysis",
@@ -19,12 +33,407 @@ if 'vectara_client' not in st.session_state:
     st.session_state.vectara_client = None
 if 'uploaded_files_list' not in st.session_state:
     st.session_state.uploaded_files_list = []
+if 'uploaded_sha' not in st.session_state:
+    st.session_state.uploaded_sha = set()
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
 if 'connected' not in st.session_state:
     st.session_state.connected = False
+if 'last_metrics' not in st.session_state:
+    st.session_state.last_metrics = None
+
+# Maximum number of files uploaded in parallel
+MAX_UPLOAD_WORKERS = 8
+
+# Keep-alive connections held per host; one per upload worker so none are discarded
+HTTP_POOL_SIZE = MAX_UPLOAD_WORKERS
+
+# (connect, read) timeouts in seconds so a stalled connection can't hang a rerun;
+# reads are longer where Vectara generates a summary or indexes a document
+HTTP_TIMEOUT = (5, 30)
+QUERY_TIMEOUT = (5, 90)
+UPLOAD_TIMEOUT = (5, 300)
+
+# Page size for the sidebar corpus listing; only this many IDs are shown
+CORPUS_DOCUMENTS_SHOWN = 10
+
+# Number of past Q&A entries kept in Tab 2, and how many of them are drawn per rerun
+MAX_CHAT_HISTORY = 50
+MAX_RENDERED_CHATS = 20
+
+# Source snippets shown per answer, and characters shown per snippet
+SNIPPETS_PER_ANSWER = 3
+SNIPPET_PREVIEW_CHARS = 300
+
+# Raw bytes base64-encoded per chunk; a multiple of 3 so chunks join without padding
+BASE64_CHUNK_SIZE = 3 * 64 * 1024
+
+# Metrics extracted when the caller doesn't pass its own list
+DEFAULT_METRICS = ["Revenue", "Net Profit", "Gross Profit", "Total Assets", "Total Liabilities"]
+
+# Search results the summarizer and metric extraction read; Tab 3 fetches only these
+SUMMARY_SOURCE_RESULTS = 5
+
+# Numeric value as printed in statements, e.g. 1,234,567.89
+METRIC_VALUE_PATTERN = r"\d{1,3}(?:,\d{3})*(?:\.\d{2})?"
+
+# Citation markers such as [1] that the summarizer inserts into generated text
+CITATION_RE = re.compile(r"\s*\[\d+\]")
+NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+# Gzip the streamed v1 index body (base64 PDFs shrink back toward their raw size)
+COMPRESS_UPLOAD_BODIES = True
+V1_INDEX_URL = "https://api.vectara.io/v1/index"
+
+# Upload metadata skeleton; only the filename needs JSON escaping per call
+UPLOAD_METADATA_TEMPLATE = '{{"filename": {name}, "upload_date": "{date}"}}'
+
+# Query cache settings
+QUERY_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".vectara_cache.db")
+QUERY_CACHE_TTL = 7 * 24 * 60 * 60  # 7 days
+QUERY_MEMORY_CACHE_SIZE = 64
+QUERY_MEMORY_CACHE_TTL = 5 * 60  # 5 minutes
+# Filler words dropped from cache keys so rephrasings of one question share an entry
+QUERY_STOPWORDS = frozenset({
+    "a", "an", "the", "please", "tell", "me", "show", "give", "find"
+})
+
+FOOTER_HTML = """
+<div style='text-align: center; color: gray; font-size: 0.9em;'>
+    <p>Vectara Financial Analysis Dashboard | Powered by Vectara RAG</p>
+</div>
+"""
 
 # Helper Functions
+@st.cache_resource
+def get_http_executor():
+    """Thread pool shared by upload batches and fan-out queries instead of one pool per click"""
+    return ThreadPoolExecutor(max_workers=MAX_UPLOAD_WORKERS, thread_name_prefix="vectara-http")
+
+@st.cache_resource
+def get_http_adapter():
+    """HTTPS adapter (and its urllib3 pools) shared by every VectaraClient session"""
+    return HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=HTTP_POOL_SIZE,
+        # Back off on rate limits and transient gateway errors, honoring Retry-After;
+        # the final response still goes through each method's status handling.
+        # Only reads and queries use this policy; uploads get get_upload_adapter()
+        max_retries=Retry(
+            total=5,
+            # A read timeout already waited the full budget, so retry it only once
+            read=1,
+            backoff_factor=0.5,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods={"GET", "POST"},
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+    )
+
+@st.cache_resource
+def get_upload_adapter():
+    """HTTPS adapter for upload POSTs, which must not be resent once the server may have them"""
+    return HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=HTTP_POOL_SIZE,
+        # After a read timeout or a 5xx the document may already be indexed, and a
+        # resend would fail as a duplicate; only retry when the request never got
+        # through (connection errors) or was rejected up front with 429
+        max_retries=Retry(
+            total=5,
+            read=0,
+            other=0,
+            backoff_factor=0.5,
+            status_forcelist=[429],
+            allowed_methods={"POST"},
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+    )
+
+def json_loads(data):
+    """Parse JSON bytes or text, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps(obj):
+    """Serialize obj to JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+class CorpusRequestError(Exception):
+    """Non-200 response from a cached corpus GET"""
+    def __init__(self, status_code, text):
+        super().__init__(f"{status_code}: {text}")
+        self.status_code = status_code
+        self.text = text
+
+# Failures are raised rather than returned so st.cache_data only keeps 200s
+@st.cache_data(ttl=60, show_spinner=False)
+def _get_corpus_info(base_url, api_key_hash, customer_id, corpus_id, _session):
+    """Fetch corpus info, cached so reruns don't repeat the GET"""
+    url = f"{base_url}/corpora/{corpus_id}"
+    response = _session.get(url, timeout=HTTP_TIMEOUT)
+    if response.status_code != 200:
+        raise CorpusRequestError(response.status_code, response.text)
+    return response.text
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _list_corpus_documents(base_url, api_key_hash, customer_id, corpus_id, limit, _session):
+    """Fetch one page of the corpus document list, cached so reruns don't repeat the GET"""
+    url = f"{base_url}/corpora/{corpus_id}/documents"
+    response = _session.get(url, params={"limit": limit}, timeout=HTTP_TIMEOUT)
+    if response.status_code != 200:
+        raise CorpusRequestError(response.status_code, response.text)
+    return json_loads(response.content)
+
+def clear_corpus_cache():
+    """Drop cached corpus info and document listings"""
+    _get_corpus_info.clear()
+    _list_corpus_documents.clear()
+
+def upload_and_record(client, upload_fn, file_content, filename, digest, uploaded_sha):
+    """Upload one file and record it on the worker thread, so a rerun can't skip the bookkeeping"""
+    success, message = upload_fn(file_content, filename)
+    if success:
+        uploaded_sha.add(digest)
+        client.upload_registry.add(client.customer_id, client.corpus_id, digest, filename)
+        # New documents must show up in the corpus listing and in answers right away
+        _list_corpus_documents.clear()
+        client.query_cache.clear_corpus(client.customer_id, client.corpus_id)
+    return success, message
+
+def stream_json_with_base64(payload, placeholder, file_content):
+    """Yield payload as JSON bytes with file_content base64-encoded in place of placeholder"""
+    # Only the v1 upload path needs base64, so import it on first use
+    import base64
+    
+    prefix, suffix = json_dumps(payload).split(json_dumps(placeholder), 1)
+    yield prefix + b'"'
+    view = memoryview(file_content)
+    for start in range(0, len(view), BASE64_CHUNK_SIZE):
+        yield base64.b64encode(view[start:start + BASE64_CHUNK_SIZE])
+    yield b'"' + suffix
+
+class ReplayableBody:
+    """Streamed request body that restarts on each iteration so retries resend it whole"""
+    
+    def __init__(self, make_chunks):
+        self.make_chunks = make_chunks
+    
+    def __iter__(self):
+        return iter(self.make_chunks())
+
+class SizedBody(ReplayableBody):
+    """Replayable body of known size, sent with Content-Length instead of chunked encoding"""
+    
+    def __init__(self, make_chunks, length):
+        super().__init__(make_chunks)
+        self.length = length
+    
+    def __len__(self):
+        return self.length
+
+def build_multipart_upload(filename, file_content, metadata):
+    """Return (content_type, body) streaming file_content as multipart without copying it"""
+    boundary = os.urandom(16).hex()
+    # HTML5-style quoting of the filename, as urllib3 does for form fields
+    quoted_name = filename.replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+    head = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="file"; filename="{quoted_name}"\r\n'
+        'Content-Type: application/pdf\r\n\r\n'
+    ).encode('utf-8')
+    # metadata must be sent as application/json (server rejects text/plain)
+    tail = (
+        f'\r\n--{boundary}\r\n'
+        'Content-Disposition: form-data; name="metadata"; filename="metadata"\r\n'
+        'Content-Type: application/json\r\n\r\n'
+        f'{metadata}\r\n'
+        f'--{boundary}--\r\n'
+    ).encode('utf-8')
+    view = memoryview(file_content)
+    parts = (head, view, tail)
+    body = SizedBody(lambda: parts, len(head) + view.nbytes + len(tail))
+    return f"multipart/form-data; boundary={boundary}", body
+
+def build_upload_metadata(filename, upload_time):
+    """Render the metadata JSON sent alongside an uploaded file"""
+    return UPLOAD_METADATA_TEMPLATE.format(name=json.dumps(filename), date=upload_time.isoformat())
+
+def gzip_stream(chunks):
+    """Gzip-compress an iterable of byte chunks on the fly"""
+    compressor = zlib.compressobj(wbits=31)  # 31 selects the gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+class QueryCache:
+    """Persistent cache of Vectara query responses keyed by normalized query text"""
+    
+    def __init__(self, path=QUERY_CACHE_PATH, ttl=QUERY_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        # Recent hits are served from memory without touching SQLite or re-parsing JSON
+        self._memory = OrderedDict()
+        # Fan-out queries read and write the LRU from worker threads
+        self._lock = threading.Lock()
+        try:
+            with sqlite3.connect(self.path) as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS query_cache ("
+                    "key TEXT PRIMARY KEY, response BLOB NOT NULL, created_at REAL NOT NULL)"
+                )
+        except sqlite3.Error:
+            # Cache is best-effort; queries still go to Vectara without it
+            self.path = None
+    
+    @staticmethod
+    def corpus_prefix(customer_id, corpus_id):
+        """Key prefix shared by every cached answer for one account's corpus"""
+        # Corpus keys are short names reused across accounts, so the account is part of it
+        return f"{customer_id}|{corpus_id}|"
+    
+    @staticmethod
+    def make_key(customer_id, api_key_hash, corpus_id, query_text, num_results):
+        """Build a cache key that ignores case, punctuation, spacing and filler words"""
+        tokens = re.findall(r"\w+", query_text.lower())
+        # Fall back to every token if the question is nothing but filler
+        normalized = " ".join([t for t in tokens if t not in QUERY_STOPWORDS] or tokens)
+        # The key hash keeps answers from being served to a key without query permission
+        prefix = QueryCache.corpus_prefix(customer_id, corpus_id)
+        return f"{prefix}{api_key_hash}|{num_results}|{normalized}"
+    
+    def get(self, key):
+        """Return the cached response for key, or None if missing or expired"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                response, stored_at = entry
+                if time.monotonic() - stored_at < QUERY_MEMORY_CACHE_TTL:
+                    self._memory.move_to_end(key)
+                    return response
+                del self._memory[key]
+        
+        if not self.path:
+            return None
+        try:
+            with sqlite3.connect(self.path) as conn:
+                row = conn.execute(
+                    "SELECT response FROM query_cache WHERE key = ? AND created_at >= ?",
+                    (key, time.time() - self.ttl)
+                ).fetchone()
+            if not row:
+                return None
+            response = json_loads(row[0])
+            self._remember(key, response)
+            return response
+        except (sqlite3.Error, ValueError):
+            return None
+    
+    def _remember(self, key, response):
+        """Add a response to the in-memory LRU, evicting the oldest entry when full"""
+        with self._lock:
+            self._memory[key] = (response, time.monotonic())
+            self._memory.move_to_end(key)
+            if len(self._memory) > QUERY_MEMORY_CACHE_SIZE:
+                self._memory.popitem(last=False)
+    
+    def set(self, key, response):
+        """Store a response and drop expired entries"""
+        self._remember(key, response)
+        if not self.path:
+            return
+        try:
+            now = time.time()
+            with sqlite3.connect(self.path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO query_cache (key, response, created_at) VALUES (?, ?, ?)",
+                    (key, json_dumps(response), now)
+                )
+                conn.execute("DELETE FROM query_cache WHERE created_at < ?", (now - self.ttl,))
+        except sqlite3.Error:
+            pass
+    
+    def clear_corpus(self, customer_id, corpus_id):
+        """Drop every cached answer for a corpus, e.g. after new documents are indexed"""
+        prefix = QueryCache.corpus_prefix(customer_id, corpus_id)
+        with self._lock:
+            for key in [k for k in self._memory if k.startswith(prefix)]:
+                del self._memory[key]
+        if not self.path:
+            return
+        try:
+            with sqlite3.connect(self.path) as conn:
+                conn.execute(
+                    "DELETE FROM query_cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+                )
+        except sqlite3.Error:
+            pass
+
+class UploadRegistry:
+    """Persistent record of uploaded content hashes per account and corpus"""
+    
+    def __init__(self, path=QUERY_CACHE_PATH):
+        self.path = path
+        try:
+            with sqlite3.connect(self.path) as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS corpus_uploads ("
+                    "customer_id TEXT NOT NULL, corpus_id TEXT NOT NULL, sha256 TEXT NOT NULL, "
+                    "filename TEXT NOT NULL, uploaded_at REAL NOT NULL, "
+                    "PRIMARY KEY (customer_id, corpus_id, sha256))"
+                )
+        except sqlite3.Error:
+            # Best-effort like the query cache; dedupe then only lasts the session
+            self.path = None
+    
+    def load(self, customer_id, corpus_id):
+        """Return the set of content hashes already uploaded to this account's corpus"""
+        if not self.path:
+            return set()
+        try:
+            with sqlite3.connect(self.path) as conn:
+                rows = conn.execute(
+                    "SELECT sha256 FROM corpus_uploads WHERE customer_id = ? AND corpus_id = ?",
+                    (customer_id, corpus_id)
+                ).fetchall()
+            return {row[0] for row in rows}
+        except sqlite3.Error:
+            return set()
+    
+    def add(self, customer_id, corpus_id, digest, filename):
+        """Record a successful upload"""
+        if not self.path:
+            return
+        try:
+            with sqlite3.connect(self.path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO corpus_uploads "
+                    "(customer_id, corpus_id, sha256, filename, uploaded_at) VALUES (?, ?, ?, ?, ?)",
+                    (customer_id, corpus_id, digest, filename, time.time())
+                )
+        except sqlite3.Error:
+            pass
+    
+    def clear(self, customer_id, corpus_id):
+        """Forget every recorded upload for this account's corpus"""
+        if not self.path:
+            return
+        try:
+            with sqlite3.connect(self.path) as conn:
+                conn.execute(
+                    "DELETE FROM corpus_uploads WHERE customer_id = ? AND corpus_id = ?",
+                    (customer_id, corpus_id)
+                )
+        except sqlite3.Error:
+            pass
+
 class VectaraClient:
     """Custom Vectara client using REST API"""
     
@@ -38,23 +447,55 @@ class VectaraClient:
             "Content-Type": "application/json",
             "customer-id": customer_id
         }
+        # Header sets built once and reused by every request
+        self._json_headers = self.headers
+        self._gzip_json_headers = {**self.headers, "Content-Encoding": "gzip"}
+        self._multipart_headers = {
+            "x-api-key": api_key,
+            "customer-id": customer_id
+        }
+        # Hashed key identifies the caller in Streamlit's cache without storing the raw key
+        self.api_key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+        self.query_cache = QueryCache()
+        self.upload_registry = UploadRegistry()
+        
+        # Pooled keep-alive session so calls reuse the TCP/TLS connection.
+        # Content-Type is left off so multipart uploads can set their own boundary.
+        self.session = requests.Session()
+        self.session.headers.update(self._multipart_headers)
+        # Ask for compressed responses; requests decodes them transparently
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        # Connection pools are shared by every client, so sessions with different
+        # credentials still reuse warm TLS connections to the API host
+        self.session.mount("https://", get_http_adapter())
+        # Longest prefix wins, so the upload endpoints get the non-resending policy
+        self.session.mount(f"{self.base_url}/corpora/{self.corpus_id}/upload_file", get_upload_adapter())
+        self.session.mount(V1_INDEX_URL, get_upload_adapter())
+    
+    def _corpus_info(self):
+        """Return (status_code, text) for the corpus info endpoint"""
+        try:
+            return 200, _get_corpus_info(
+                self.base_url, self.api_key_hash, self.customer_id, self.corpus_id, self.session
+            )
+        except CorpusRequestError as e:
+            return e.status_code, e.text
     
     def test_connection(self):
         """Test the connection to Vectara"""
         try:
-            url = f"{self.base_url}/corpora/{self.corpus_id}"
-            response = requests.get(url, headers=self.headers)
+            status_code, text = self._corpus_info()
             
-            if response.status_code == 200:
+            if status_code == 200:
                 return True, "Connection successful!"
-            elif response.status_code == 403:
+            elif status_code == 403:
                 return False, "403 Forbidden - Check your API key and permissions"
-            elif response.status_code == 401:
+            elif status_code == 401:
                 return False, "401 Unauthorized - Invalid API key"
-            elif response.status_code == 404:
+            elif status_code == 404:
                 return False, "404 Not Found - Invalid Corpus ID"
             else:
-                return False, f"Error {response.status_code}: {response.text}"
+                return False, f"Error {status_code}: {text}"
         except Exception as e:
             return False, f"Connection error: {str(e)}"
     
@@ -64,24 +505,13 @@ class VectaraClient:
             # Use the file upload endpoint with multipart
             url = f"{self.base_url}/corpora/{self.corpus_id}/upload_file"
             
-            # Prepare headers for file upload (remove Content-Type, let requests set it)
-            headers = {
-                "x-api-key": self.api_key,
-                "customer-id": self.customer_id
-            }
-            
-            # Prepare multipart body with explicit metadata content type
-            metadata = json.dumps({
-                'filename': filename,
-                'upload_date': datetime.now().isoformat()
-            })
-            files = {
-                'file': (filename, file_content, 'application/pdf'),
-                # metadata must be sent as application/json (server rejects text/plain)
-                'metadata': ('metadata', metadata, 'application/json')
-            }
+            # Prepare multipart body with explicit metadata content type; the PDF is
+            # streamed from the caller's buffer instead of being copied into the body
+            metadata = build_upload_metadata(filename, datetime.now())
+            content_type, body = build_multipart_upload(filename, file_content, metadata)
             
-            response = requests.post(url, headers=headers, files=files)
+            headers = {**self._multipart_headers, "Content-Type": content_type}
+            response = self.session.post(url, headers=headers, data=body, timeout=UPLOAD_TIMEOUT)
             
             if response.status_code in [200, 201]:
                 return True, f"Successfully uploaded: {filename}"
@@ -98,37 +528,37 @@ class VectaraClient:
     def upload_file_v1(self, file_content, filename):
         """Alternative upload method using v1 API - Index Document"""
         try:
-            url = f"https://api.vectara.io/v1/index"
-            
-            headers = {
-                "x-api-key": self.api_key,
-                "Content-Type": "application/json",
-                "customer-id": self.customer_id
-            }
+            url = V1_INDEX_URL
             
-            # Convert PDF to base64
-            file_base64 = base64.b64encode(file_content).decode('utf-8')
+            # PDF is base64-encoded chunk by chunk while streaming, never as one string
+            file_placeholder = "__FILE_BASE64__"
             
             # Create document payload
+            upload_time = datetime.now()
             payload = {
                 "customer_id": int(self.customer_id),
                 "corpus_id": int(self.corpus_id),
                 "document": {
-                    "document_id": f"doc_{datetime.now().timestamp()}_{filename}",
+                    # Random ID: concurrent uploads can share a timestamp (and a filename)
+                    "document_id": f"doc_{uuid.uuid4().hex}_{filename}",
                     "title": filename,
-                    "metadata_json": json.dumps({
-                        "filename": filename,
-                        "upload_date": datetime.now().isoformat()
-                    }),
+                    "metadata_json": build_upload_metadata(filename, upload_time),
                     "section": [
                         {
-                            "text": file_base64
+                            "text": file_placeholder
                         }
                     ]
                 }
             }
             
-            response = requests.post(url, headers=headers, json=payload)
+            def body_chunks():
+                chunks = stream_json_with_base64(payload, file_placeholder, file_content)
+                return gzip_stream(chunks) if COMPRESS_UPLOAD_BODIES else chunks
+            
+            headers = self._gzip_json_headers if COMPRESS_UPLOAD_BODIES else self._json_headers
+            response = self.session.post(
+                url, headers=headers, data=ReplayableBody(body_chunks), timeout=UPLOAD_TIMEOUT
+            )
             
             if response.status_code in [200, 201]:
                 return True, f"Successfully uploaded: {filename}"
@@ -148,9 +578,8 @@ class VectaraClient:
             can_read = read_test[1] is None
             
             # Check corpus info
-            url = f"{self.base_url}/corpora/{self.corpus_id}"
-            response = requests.get(url, headers=self.headers)
-            can_view_corpus = response.status_code == 200
+            status_code, _ = self._corpus_info()
+            can_view_corpus = status_code == 200
             
             return {
                 "can_read": can_read,
@@ -160,9 +589,17 @@ class VectaraClient:
         except Exception as e:
             return {"error": str(e)}
     
-    def query(self, query_text, num_results=10):
+    def query(self, query_text, num_results=10, use_cache=True):
         """Query the Vectara corpus"""
         try:
+            # Serve repeated questions from the local cache before hitting the API
+            cache_key = QueryCache.make_key(
+                self.customer_id, self.api_key_hash, self.corpus_id, query_text, num_results
+            )
+            cached = self.query_cache.get(cache_key) if use_cache else None
+            if cached is not None:
+                return cached, None
+            
             url = f"{self.base_url}/query"
             
             payload = {
@@ -175,14 +612,19 @@ class VectaraClient:
                 },
                 "generation": {
                     "generation_preset_name": "vectara-summary-ext-v1.2.0",
-                    "max_used_search_results": 5
+                    "max_used_search_results": SUMMARY_SOURCE_RESULTS
                 }
             }
             
-            response = requests.post(url, headers=self.headers, json=payload)
+            response = self.session.post(
+                url, headers=self._json_headers, data=json_dumps(payload), timeout=QUERY_TIMEOUT
+            )
             
             if response.status_code == 200:
-                return response.json(), None
+                result = json_loads(response.content)
+                if use_cache:
+                    self.query_cache.set(cache_key, result)
+                return result, None
             elif response.status_code == 403:
                 return None, f"403 Forbidden - Check query permissions: {response.text}"
             else:
@@ -191,24 +633,28 @@ class VectaraClient:
         except Exception as e:
             return None, f"Error querying: {str(e)}"
     
-    def list_documents(self):
-        """List all documents in the corpus"""
+    def list_documents(self, limit=CORPUS_DOCUMENTS_SHOWN):
+        """List the first page of documents in the corpus"""
         try:
-            url = f"{self.base_url}/corpora/{self.corpus_id}/documents"
-            response = requests.get(url, headers=self.headers)
+            body = _list_corpus_documents(
+                self.base_url, self.api_key_hash, self.customer_id, self.corpus_id, limit, self.session
+            )
+            return body, None
             
-            if response.status_code == 200:
-                return response.json(), None
-            else:
-                return None, f"Failed to list documents ({response.status_code}): {response.text}"
-                
+        except CorpusRequestError as e:
+            return None, f"Failed to list documents ({e.status_code}): {e.text}"
         except Exception as e:
             return None, f"Error listing documents: {str(e)}"
 
+@st.cache_resource(show_spinner=False)
+def get_vectara_client(api_key, customer_id, corpus_id):
+    """One client (and connection pool) per credential set, shared across reruns and sessions"""
+    return VectaraClient(api_key, customer_id, corpus_id)
+
 def initialize_vectara(api_key, customer_id, corpus_id):
     """Initialize Vectara client with credentials"""
     try:
-        client = VectaraClient(api_key, customer_id, corpus_id)
+        client = get_vectara_client(api_key, customer_id, corpus_id)
         # Test the connection
         success, message = client.test_connection()
         if success:
@@ -218,34 +664,114 @@ def initialize_vectara(api_key, customer_id, corpus_id):
     except Exception as e:
         return None, str(e)
 
+def build_metric_regex(metric_names):
+    """Compile one pattern matching any metric name followed by its value"""
+    # Longest names first so "Net Profit" wins over a custom "Profit"; ties are broken
+    # alphabetically so the same names always give the same pattern string, which
+    # lets re's internal compile cache reuse it across reruns
+    names = sorted({name for name in metric_names if name}, key=lambda name: (-len(name), name))
+    if not names:
+        return None
+    alternation = "|".join(re.escape(name) for name in names)
+    # Every \s* after the first follows a required literal (":", "(", "$"), so a
+    # whitespace run can only be split one way and the scan stays linear
+    return re.compile(
+        rf"(?P<name>{alternation})\s*(?:[:\-]\s*)?(?:\(\s*)?(?:\$\s*)?(?P<value>{METRIC_VALUE_PATTERN})",
+        re.IGNORECASE
+    )
+
+def parse_metrics_json(summary, metric_names):
+    """Parse numeric metric values from a JSON object in the generated summary"""
+    start, end = summary.find("{"), summary.rfind("}")
+    if start == -1 or end <= start:
+        return {}
+    try:
+        data = json.loads(CITATION_RE.sub("", summary[start:end + 1]))
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    
+    values = {str(key).lower(): value for key, value in data.items()}
+    parsed = {}
+    for name in metric_names:
+        value = str(values.get(name.lower(), "")).replace(",", "").replace("$", "").strip()
+        if NUMBER_RE.fullmatch(value):
+            parsed[name] = value
+    return parsed
+
 def extract_metrics_from_response(response_data, metric_names=None):
     """Extract financial metrics from Vectara response"""
     if metric_names is None:
-        metric_names = ["Revenue", "Net Profit", "Gross Profit", "Total Assets", "Total Liabilities"]
+        metric_names = DEFAULT_METRICS
     
     metrics = {name: "N/A" for name in metric_names}
     
-    if response_data and 'search_results' in response_data:
-        combined_text = ""
-        for result in response_data['search_results'][:5]:
-            if 'text' in result:
-                combined_text += " " + result['text']
-        
-        for metric in metric_names:
-            # Try different patterns
-            patterns = [
-                rf"{metric}\s*[:\-]?\s*\$?\s*(\d{{1,3}}(?:,\d{{3}})*(?:\.\d{{2}})?)",
-                rf"{metric}\s*\(?\$?(\d{{1,3}}(?:,\d{{3}})*(?:\.\d{{2}})?)\)?",
-            ]
-            
-            for pattern in patterns:
-                match = re.search(pattern, combined_text, re.IGNORECASE)
-                if match:
-                    metrics[metric] = match.group(1).replace(",", "")
-                    break
+    if not response_data:
+        return metrics
+    
+    # Structured JSON from the summarizer is used first; regex only fills the gaps
+    metrics.update(parse_metrics_json(response_data.get('summary') or "", metric_names))
+    missing = [name for name in metric_names if metrics[name] == "N/A"]
+    
+    if missing and 'search_results' in response_data:
+        # Scan each top snippet in place rather than concatenating them first;
+        # the first value seen for each metric wins
+        # Blank names would pass the substring pre-filter ('' is in every text)
+        canonical = {name.lower(): name for name in missing if name}
+        for result in response_data['search_results'][:SUMMARY_SOURCE_RESULTS]:
+            text = result.get('text') or ""
+            # Cheap substring pre-filter: most snippets mention few or none of
+            # the metrics, so only those names go into the regex
+            lowered = text.lower()
+            present = [name for key, name in canonical.items() if key in lowered]
+            if not present:
+                continue
+            
+            metric_re = build_metric_regex(present)
+            for match in metric_re.finditer(text):
+                key = match.group('name').lower()
+                if key in canonical:
+                    metrics[canonical.pop(key)] = match.group('value').replace(",", "")
+                    if not canonical:
+                        return metrics
     
     return metrics
 
+@st.cache_data(ttl=600, show_spinner=False)
+def build_comparison_frames(metric_values):
+    """Build the comparison table, its numeric copy for charting and the CSV export"""
+    # pandas is slow to import and only Tab 3 needs it, so keep it off the cold start
+    import pandas as pd
+    
+    # Values are already keyed by metric in display order, so build the column directly
+    df = pd.Series(metric_values, name='Document Analysis', dtype=object).to_frame()
+    df.index.name = 'Metric'
+    
+    # Convert to numeric for visualization
+    df_numeric = df.apply(pd.to_numeric, errors='coerce')
+    
+    # Encode straight to bytes once, instead of a str that the download button re-encodes every rerun
+    buf = io.BytesIO()
+    df.to_csv(buf, encoding='utf-8', lineterminator='\n')
+    
+    return df, df_numeric, buf.getvalue()
+
+def build_snippets_markdown(response_data):
+    """Precompute the labelled, truncated source snippets under an answer as one markdown block"""
+    parts = []
+    results = response_data.get('search_results', [])[:SNIPPETS_PER_ANSWER]
+    for j, result in enumerate(results, 1):
+        text = result.get('text', 'N/A')
+        if len(text) > SNIPPET_PREVIEW_CHARS:
+            text = text[:SNIPPET_PREVIEW_CHARS] + "..."
+        # Fence longer than any backtick run in the snippet so it is shown verbatim
+        fence = "`" * max(3, max((len(run) for run in re.findall(r"`+", text)), default=0) + 1)
+        parts.append(
+            f"**Source {j}** (Score: {result.get('score', 0):.3f})\n\n{fence}\n{text}\n{fence}"
+        )
+    return "\n\n---\n\n".join(parts)
+
 # Main App Layout
 st.title("📊 Vectara Financial Analysis Dashboard")
 st.markdown("Upload financial documents, query them intelligently, and compare metrics across multiple files.")
@@ -310,10 +836,16 @@ with st.sidebar:
     if st.button("Connect to Vectara", type="primary"):
         if api_key and customer_id and corpus_id:
             with st.spinner("Testing connection..."):
+                # Always validate fresh credentials against the API
+                clear_corpus_cache()
                 client, error = initialize_vectara(api_key, customer_id, corpus_id)
                 if client:
                     st.session_state.vectara_client = client
                     st.session_state.connected = True
+                    # Content uploaded to this corpus in earlier runs is skipped too
+                    st.session_state.uploaded_sha = client.upload_registry.load(customer_id, corpus_id)
+                    # Metrics extracted from the previous corpus don't describe this one
+                    st.session_state.last_metrics = None
                     st.success("✅ Connected successfully!")
                     st.rerun()
                 else:
@@ -328,6 +860,19 @@ with st.sidebar:
     if st.session_state.connected and st.session_state.vectara_client:
         st.success("🟢 Connected")
         
+        # Drop cached corpus responses so the next check hits the API
+        if st.button("🔄 Refresh Corpus Info"):
+            clear_corpus_cache()
+        
+        # Forget uploaded content hashes so identical files can be sent again
+        if st.button("♻️ Reset Upload Cache"):
+            st.session_state.uploaded_sha = set()
+            client = st.session_state.vectara_client
+            client.upload_registry.clear(client.customer_id, client.corpus_id)
+        
+        st.checkbox("Do not cache queries", key="bypass_query_cache",
+                    help="Always send questions to Vectara and don't store the answers locally")
+        
         # List documents in corpus
         if st.button("🔍 View Corpus Documents"):
             with st.spinner("Loading documents..."):
@@ -335,10 +880,15 @@ with st.sidebar:
                 if error:
                     st.error(f"Error: {error}")
                 elif docs and 'documents' in docs:
-                    st.write(f"**Documents in corpus:** {len(docs['documents'])}")
-                    for i, doc in enumerate(docs['documents'][:10], 1):
-                        doc_id = doc.get('id', 'N/A')
-                        st.text(f"{i}. ID: {doc_id}")
+                    st.write(f"**Documents listed:** {len(docs['documents'])}")
+                    # Only one page is fetched; a page key means there are more
+                    if (docs.get('metadata') or {}).get('page_key'):
+                        st.caption(f"Showing the first {CORPUS_DOCUMENTS_SHOWN} documents.")
+                    # One text element for the whole list instead of one per document
+                    st.text("\n".join(
+                        f"{i}. ID: {doc.get('id', 'N/A')}"
+                        for i, doc in enumerate(docs['documents'], 1)
+                    ))
                 else:
                     st.info("No documents found")
         
@@ -346,6 +896,7 @@ with st.sidebar:
         if st.button("Disconnect", type="secondary"):
             st.session_state.vectara_client = None
             st.session_state.connected = False
+            st.session_state.last_metrics = None
             st.rerun()
     else:
         st.warning("🔴 Not Connected")
@@ -380,39 +931,70 @@ with tab1:
             status_text = st.empty()
             
             success_count = 0
-            total_files = len(uploaded_files)
+            
+            # Bind session state once rather than going through its proxy per file
+            uploaded_list = st.session_state.uploaded_files_list
+            uploaded_sha = st.session_state.uploaded_sha
+            seen_names = set(uploaded_list)
+            
+            # Skip content already uploaded to this corpus or selected twice in this batch
+            pending = {}
+            for file in uploaded_files:
+                file_content = file.getbuffer()
+                digest = hashlib.sha256(file_content).hexdigest()
+                if digest in uploaded_sha or digest in pending:
+                    st.info(f"Skipping {file.name} - identical content was already uploaded")
+                else:
+                    pending[digest] = (file.name, file_content)
+            total_files = len(pending)
             
             client = st.session_state.vectara_client
             
-            for i, file in enumerate(uploaded_files):
-                status_text.text(f"Uploading {file.name}...")
-                
-                # Read file content
-                file_content = file.read()
-                
-                # Choose upload method
-                if upload_method == "V1 API (Alternative)":
-                    success, message = client.upload_file_v1(file_content, file.name)
-                else:
-                    success, message = client.upload_file(file_content, file.name)
-                
-                if success:
-                    st.success(message)
-                    success_count += 1
-                    if file.name not in st.session_state.uploaded_files_list:
-                        st.session_state.uploaded_files_list.append(file.name)
-                else:
-                    st.error(message)
+            # Choose upload method
+            if upload_method == "V1 API (Alternative)":
+                upload_fn = client.upload_file_v1
+            else:
+                upload_fn = client.upload_file
+            
+            status_text.text(f"Uploading {total_files} file(s)...")
+            
+            # Uploads are network-bound, so run them concurrently over the shared
+            # session; Streamlit calls stay on the script thread.
+            # getbuffer() is a zero-copy view of the uploaded bytes, unlike read().
+            if pending:
+                executor = get_http_executor()
+                futures = {
+                    executor.submit(
+                        upload_and_record, client, upload_fn, file_content, filename, digest, uploaded_sha
+                    ): filename
+                    for digest, (filename, file_content) in pending.items()
+                }
                 
-                progress_bar.progress((i + 1) / total_files)
+                for i, future in enumerate(as_completed(futures)):
+                    filename = futures[future]
+                    success, message = future.result()
+                    
+                    if success:
+                        success_count += 1
+                        if filename not in seen_names:
+                            seen_names.add(filename)
+                            uploaded_list.append(filename)
+                        st.success(message)
+                    else:
+                        st.error(message)
+                    
+                    progress_bar.progress((i + 1) / total_files)
+            else:
+                progress_bar.progress(1.0)
             
             status_text.text(f"Upload complete! {success_count}/{total_files} files uploaded successfully.")
         
         # Display uploaded files
         if st.session_state.uploaded_files_list:
             st.subheader("📋 Uploaded Files")
-            for i, filename in enumerate(st.session_state.uploaded_files_list, 1):
-                st.text(f"{i}. {filename}")
+            st.text("\n".join(
+                f"{i}. {filename}" for i, filename in enumerate(st.session_state.uploaded_files_list, 1)
+            ))
 
 # Tab 2: Query Documents
 with tab2:
@@ -435,49 +1017,52 @@ with tab2:
         with col2:
             if st.button("🗑️ Clear History", key="clear_btn"):
                 st.session_state.chat_history = []
-                st.rerun()
         
         if query_button and query_input:
             with st.spinner("Searching..."):
                 client = st.session_state.vectara_client
-                response, error = client.query(query_input)
+                response, error = client.query(
+                    query_input, use_cache=not st.session_state.get("bypass_query_cache", False)
+                )
                 
                 if error:
                     st.error(f"Query error: {error}")
                 else:
-                    # Add to chat history
+                    # Add to chat history; snippets are truncated once here, not per rerun
                     st.session_state.chat_history.append({
                         'timestamp': datetime.now().strftime("%H:%M:%S"),
                         'query': query_input,
-                        'response': response
+                        'summary': response.get('summary'),
+                        'snippets_md': build_snippets_markdown(response)
                     })
-                    st.rerun()
+                    # Bound the per-rerun render cost by dropping the oldest entries;
+                    # history is drawn below in this same run, so no st.rerun() is needed
+                    del st.session_state.chat_history[:-MAX_CHAT_HISTORY]
         
         # Display chat history
         if st.session_state.chat_history:
             st.divider()
             st.subheader("💬 Conversation History")
             
-            for i, chat in enumerate(reversed(st.session_state.chat_history)):
-                with st.container():
-                    st.markdown(f"**🕐 {chat['timestamp']}**")
-                    st.markdown(f"**Q:** {chat['query']}")
-                    
-                    # Display generated summary
-                    if 'summary' in chat['response']:
-                        st.markdown(f"**A:** {chat['response']['summary']}")
-                    
-                    # Display search results
-                    if 'search_results' in chat['response']:
-                        with st.expander("📄 View Source Snippets"):
-                            for j, result in enumerate(chat['response']['search_results'][:3], 1):
-                                score = result.get('score', 0)
-                                text = result.get('text', 'N/A')
-                                st.markdown(f"**Source {j}** (Score: {score:.3f})")
-                                st.text(text[:300] + "..." if len(text) > 300 else text)
-                                st.markdown("---")
+            # Only the latest turns are drawn; older ones stay in state
+            history = st.session_state.chat_history
+            if len(history) > MAX_RENDERED_CHATS:
+                st.caption(f"Showing the {MAX_RENDERED_CHATS} most recent of {len(history)} questions.")
+            
+            with st.container():
+                for chat in reversed(history[-MAX_RENDERED_CHATS:]):
+                    with st.chat_message("user"):
+                        st.markdown(f"**🕐 {chat['timestamp']}**  \n{chat['query']}")
                     
-                    st.divider()
+                    with st.chat_message("assistant"):
+                        # Display generated summary
+                        if chat['summary']:
+                            st.markdown(chat['summary'])
+                        
+                        # Display search results as one element rather than three per source
+                        if chat.get('snippets_md'):
+                            with st.expander("📄 View Source Snippets"):
+                                st.markdown(chat['snippets_md'])
 
 # Tab 3: Financial Comparison
 with tab3:
@@ -496,67 +1081,95 @@ with tab3:
             key="custom_metrics_input"
         )
         
-        all_metrics = default_metrics.copy()
-        if custom_metrics:
-            all_metrics.extend([m.strip() for m in custom_metrics.split(',')])
+        extras = [m.strip() for m in custom_metrics.split(',')] if custom_metrics else []
+        # Drop blanks and repeats (ignoring case) so no metric is queried twice
+        unique_metrics = {}
+        for metric in default_metrics + extras:
+            if metric:
+                unique_metrics.setdefault(metric.lower(), metric)
+        all_metrics = list(unique_metrics.values())
         
-        # Query for each metric
+        # Query for all metrics at once
         if st.button("📊 Generate Comparison", type="primary", key="comparison_btn"):
             with st.spinner("Extracting financial metrics..."):
                 client = st.session_state.vectara_client
-                comparison_data = {}
                 
-                # Query for all metrics at once
-                query_text = f"financial statements showing: {', '.join(all_metrics)}"
-                response, error = client.query(query_text, num_results=10)
+                # Ask the summarizer for structured output so extraction is a JSON parse
+                query_text = (
+                    f"Extract these metrics from the financial statements as strict JSON "
+                    f"with keys {json.dumps(all_metrics)} and numeric string values, "
+                    f"no commentary: {', '.join(all_metrics)}"
+                )
+                use_cache = not st.session_state.get("bypass_query_cache", False)
+                # Only the top results feed the summary and the regex fallback
+                response, error = client.query(
+                    query_text, num_results=SUMMARY_SOURCE_RESULTS, use_cache=use_cache
+                )
                 
                 if not error and response:
-                    metrics = extract_metrics_from_response(response, all_metrics)
-                    comparison_data['Document Analysis'] = metrics
+                    values = extract_metrics_from_response(response, all_metrics)
                     
-                    # Create comparison DataFrame
-                    if comparison_data:
-                        df = pd.DataFrame(comparison_data)
-                        df.index.name = 'Metric'
-                        
-                        st.subheader("📋 Metrics Summary")
-                        st.dataframe(df, use_container_width=True)
-                        
-                        # Convert to numeric for visualization
-                        df_numeric = df.copy()
-                        for col in df_numeric.columns:
-                            df_numeric[col] = pd.to_numeric(df_numeric[col], errors='coerce')
-                        
-                        # Chart visualization
-                        st.subheader("📊 Visual Comparison")
-                        chart_metric = st.selectbox("Select metric to visualize:", all_metrics, key="chart_metric_select")
-                        
-                        if chart_metric in df_numeric.index:
-                            chart_data = df_numeric.loc[chart_metric].dropna()
-                            if not chart_data.empty:
-                                st.bar_chart(chart_data)
-                            else:
-                                st.info("No numeric data available for this metric.")
-                        
-                        # Download option
-                        csv = df.to_csv()
-                        st.download_button(
-                            label="📥 Download Comparison as CSV",
-                            data=csv,
-                            file_name="financial_comparison.csv",
-                            mime="text/csv",
-                            key="download_csv_btn"
-                        )
+                    # Metrics the bundled answer missed get a focused query each,
+                    # run concurrently so the retry costs about one round-trip
+                    missing = [m for m in all_metrics if values[m] == "N/A"]
+                    if missing:
+                        executor = get_http_executor()
+                        futures = {
+                            executor.submit(
+                                client.query, f"{metric} figure from the financial statements",
+                                num_results=SUMMARY_SOURCE_RESULTS, use_cache=use_cache
+                            ): metric
+                            for metric in missing
+                        }
+                        for future in as_completed(futures):
+                            metric = futures[future]
+                            metric_response, metric_error = future.result()
+                            if not metric_error and metric_response:
+                                values[metric] = extract_metrics_from_response(metric_response, [metric])[metric]
+                    
+                    # Keep the result so reruns (e.g. the chart selectbox) don't re-query
+                    st.session_state.last_metrics = {
+                        'metrics': all_metrics,
+                        'values': values
+                    }
                 else:
                     st.error(f"Error extracting metrics: {error}")
+        
+        if st.session_state.last_metrics:
+            # Cached on the extracted values, so chart reruns skip the pandas work
+            df, df_numeric, csv_bytes = build_comparison_frames(st.session_state.last_metrics['values'])
+            
+            st.subheader("📋 Metrics Summary")
+            # Small read-only table: a static table is cheaper than the interactive grid
+            st.table(df)
+            
+            # Chart visualization
+            st.subheader("📊 Visual Comparison")
+            chart_metric = st.selectbox(
+                "Select metric to visualize:",
+                st.session_state.last_metrics['metrics'],
+                key="chart_metric_select"
+            )
+            
+            if chart_metric in df_numeric.index:
+                chart_data = df_numeric.loc[chart_metric].dropna()
+                if not chart_data.empty:
+                    st.bar_chart(chart_data)
+                else:
+                    st.info("No numeric data available for this metric.")
+            
+            # Download option
+            st.download_button(
+                label="📥 Download Comparison as CSV",
+                data=csv_bytes,
+                file_name="financial_comparison.csv",
+                mime="text/csv",
+                key="download_csv_btn"
+            )
 
 # Footer
 st.divider()
-st.markdown("""
-<div style='text-align: center; color: gray; font-size: 0.9em;'>
-    <p>Vectara Financial Analysis Dashboard | Powered by Vectara RAG</p>
-</div>
-""", unsafe_allow_html=True)
+st.markdown(FOOTER_HTML, unsafe_allow_html=True)
 
 
 